@@ -5,18 +5,80 @@
 
 import atexit
 import contextlib
-import io
+import itertools
 import json
 import pathlib
 import subprocess
+import sys
 import threading
-import uuid
-from concurrent.futures import ThreadPoolExecutor
-from typing import BinaryIO, Dict, Optional, Sequence, Union
+from typing import Any, BinaryIO, Dict, Optional, Sequence, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    # Windows では fcntl を利用できません。
+    fcntl = None
+
+try:
+    # orjson が利用可能な場合は、より高速なシリアライザーを使用します。
+    import orjson  # pylint: disable=import-error
+except ImportError:
+    orjson = None
+
+try:
+    # ランナーとの通信では、両方で利用可能な場合に msgpack を使用します。
+    import msgpack  # pylint: disable=import-error
+except ImportError:
+    msgpack = None
+
+
+def _dumps_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=True).encode("ascii")
+
+
+# orjson は対になっていないサロゲートを含む文字列を拒否しますが、標準の json は
+# 受け付けます。そのような文字列 (編集中のソースなど) も送受信できるように、
+# orjson が失敗した場合は標準の json で処理し直します。
+def _dumps_orjson(data) -> bytes:
+    try:
+        return orjson.dumps(data)  # pylint: disable=no-member
+    except TypeError:
+        return _dumps_json(data)
+
+
+def _loads_orjson(content):
+    try:
+        return orjson.loads(content)  # pylint: disable=no-member
+    except ValueError:
+        return json.loads(content)
+
+
+_dumps = _dumps_orjson if orjson else _dumps_json
+_loads = _loads_orjson if orjson else json.loads
+
+# このプロセスで利用できるメッセージ形式 (優先順)。
+SUPPORTED_FORMATS = ("msgpack", "json") if msgpack else ("json",)
 
 CONTENT_LENGTH = "Content-Length: "
+_CONTENT_LENGTH_PREFIX = CONTENT_LENGTH.encode("ascii")
+_CONTENT_LENGTH_PREFIX_LEN = len(_CONTENT_LENGTH_PREFIX)
+# ヘッダーと本文を 1 つのバッファにまとめて書き込むためのヘッダー テンプレート。
+_HEADER_TEMPLATE = _CONTENT_LENGTH_PREFIX + b"%d\r\n\r\n"
+# ヘッダー部の終わりを示す空行。
+_HEADER_END = (b"\r\n", b"\n")
+# プロセスの停止時に、強制終了するまで待機する時間 (秒)。
+_STOP_TIMEOUT = 1.0
+# サブプロセスとの通信に使用するパイプのバッファ サイズ。
+_PIPE_BUFFER_SIZE = 1024 * 1024
+# ファイル記述子から一度に読み取る最大バイト数。
+_READ_CHUNK_SIZE = 64 * 1024
+# Linux の F_SETPIPE_SZ (Python 3.10 より前の fcntl モジュールには定義がありません)。
+_F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
 RUNNER_SCRIPT = str(pathlib.Path(__file__).parent / "lsp_runner.py")
 
+# 要求 ID の生成に使用するプロセス内で一意なカウンター。
+_next_id = itertools.count().__next__
+
 
 def to_str(text) -> str:
     """必要に応じてバイトを文字列に変換します。"""
@@ -29,12 +91,54 @@ class StreamClosedException(Exception):
     pass  # pylint: disable=unnecessary-pass
 
 
+def _get_raw(stream: BinaryIO):
+    """バッファ付き IO を介さずに読み書きするための、基礎となる FileIO を返します。"""
+    # ファイル記述子の番号を保持すると、ストリームが閉じられた後にその番号が
+    # 新しいパイプに再利用された場合に、別のプロセスと通信してしまいます。
+    # FileIO は閉じられた後の読み書きで ValueError を発生させます。
+    return getattr(stream, "raw", stream)
+
+
+def _write_all(raw, data) -> None:
+    """指定されたデータをすべて FileIO に書き込みます。"""
+    written = raw.write(data)
+    if written < len(data):
+        with memoryview(data) as view:
+            while written < len(data):
+                written += raw.write(view[written:])
+
+
 class JsonWriter:
-    """ライター ストリームへの JSON-RPC メッセージの書き込みを管理します。"""
+    """ライター ストリームへの JSON-RPC メッセージの書き込みを管理します。
 
-    def __init__(self, writer: io.TextIOWrapper):
+    単一のライターだけが使用するストリームのため、バッファ付き IO を介さずに
+    ファイル記述子へ直接書き込みます。
+    """
+
+    def __init__(self, writer: BinaryIO):
         self._writer = writer
+        self._raw = _get_raw(writer)
         self._lock = threading.Lock()
+        # メッセージごとの割り当てを避けるため、ロック内で再利用するバッファ。
+        self._buffer = bytearray()
+        self._msgpack = False
+
+    def set_format(self, message_format: str) -> None:
+        """以降のメッセージの形式 ("json" または "msgpack") を設定します。"""
+        self._msgpack = message_format == "msgpack"
+
+    def _encode(self, data) -> Tuple[bytes, bytes]:
+        """データをエンコードし、長さのヘッダーと本文を返します。"""
+        # msgpack でも Content-Length ヘッダーを付けることで、読み取り側は
+        # ストリームに紛れ込んだ出力を読み飛ばしてメッセージの先頭を見つけられます。
+        if self._msgpack:
+            content = msgpack.packb(
+                data, use_bin_type=True, unicode_errors="surrogatepass"
+            )
+        else:
+            content = _dumps(data)
+        # エンコード済みのバイト列の長さをそのまま長さのヘッダーに使用します。
+        return _HEADER_TEMPLATE % len(content), content
 
     def close(self):
         """基礎となるライター ストリームを閉じます。"""
@@ -44,23 +148,114 @@ class JsonWriter:
 
     def write(self, data):
         """指定されたデータを JSON-RPC 形式でストリームに書き込みます。"""
+        with self._lock:
+            # close() も同じロックを取得するため、確認から書き込みまでの間に
+            # ストリームが閉じられることはありません。
+            if self._writer.closed:
+                raise StreamClosedException()
+            header, content = self._encode(data)
+            # ヘッダーと本文を 1 回の write にまとめ、メッセージごとのシステム コールを減らします。
+            buffer = self._buffer
+            buffer.clear()
+            buffer += header
+            buffer += content
+            _write_all(self._raw, buffer)
+
+
+class BatchingJsonWriter(JsonWriter):
+    """短い間隔で届いたメッセージをまとめてライター ストリームに書き込みます。
+
+    `write` はメッセージをキューに追加するだけで、バックグラウンド スレッドが
+    待機中のメッセージを 1 回の write で書き込みます。
+    """
+
+    def __init__(
+        self,
+        writer: BinaryIO,
+        max_delay: float = 0.0005,
+        max_size: int = 64 * 1024,
+    ):
+        super().__init__(writer)
+        self._max_delay = max_delay
+        self._max_size = max_size
+        self._pending = bytearray()
+        self._ready = threading.Condition()
+        self._closing = False
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        """待機中のメッセージを書き込んでから、基礎となるライター ストリームを閉じます。"""
+        with self._ready:
+            self._closing = True
+            self._ready.notify()
+        self._flusher.join()
+        super().close()
+
+    def write(self, data):
+        """指定されたデータを JSON-RPC 形式で書き込みキューに追加します。"""
         if self._writer.closed:
             raise StreamClosedException()
 
-        with self._lock:
-            content = json.dumps(data)
-            length = len(content.encode("utf-8"))
-            self._writer.write(
-                f"{CONTENT_LENGTH}{length}\r\n\r\n{content}".encode("utf-8")
-            )
-            self._writer.flush()
+        header, content = self._encode(data)
+        with self._ready:
+            if self._closing:
+                raise StreamClosedException()
+            was_empty = not self._pending
+            self._pending += header
+            self._pending += content
+            # 待機中のスレッドは、キューが空でなくなったときと
+            # サイズの上限を超えたときだけ起こします。
+            if was_empty or len(self._pending) >= self._max_size:
+                self._ready.notify()
+
+    def _flush_loop(self):
+        spare = bytearray()
+        while True:
+            with self._ready:
+                while not self._pending and not self._closing:
+                    self._ready.wait()
+                if not self._closing and len(self._pending) < self._max_size:
+                    # 後続のメッセージが届くのを少しだけ待ち、まとめて書き込みます。
+                    self._ready.wait(self._max_delay)
+                pending, self._pending = self._pending, spare
+                closing = self._closing
+
+            if pending:
+                try:
+                    with self._lock:
+                        if self._writer.closed:
+                            raise StreamClosedException()
+                        _write_all(self._raw, pending)
+                except Exception:  # pylint: disable=broad-except
+                    # ストリームが閉じられたため、以降の書き込みは拒否します。
+                    with self._ready:
+                        self._closing = True
+                        self._pending.clear()
+                    return
+                pending.clear()
+            spare = pending
+
+            if closing:
+                return
 
 
 class JsonReader:
-    """ストリームからの JSON-RPC メッセージの読み取りを管理します。"""
+    """ストリームからの JSON-RPC メッセージの読み取りを管理します。
+
+    単一のリーダーだけが使用するストリームのため、バッファ付き IO を介さずに
+    ファイル記述子から直接読み取り、独自のバッファで区切りを処理します。
+    """
 
-    def __init__(self, reader: io.TextIOWrapper):
+    def __init__(self, reader: BinaryIO):
         self._reader = reader
+        self._raw = _get_raw(reader)
+        self._buffer = bytearray()
+        self._msgpack = False
+
+    def set_format(self, message_format: str) -> None:
+        """以降のメッセージの形式 ("json" または "msgpack") を設定します。"""
+        self._msgpack = message_format == "msgpack"
 
     def close(self):
         """基になるリーダー ストリームを閉じます。"""
@@ -71,32 +266,71 @@ class JsonReader:
         """ストリームから JSON-RPC 形式でデータを読み取ります。"""
         if self._reader.closed:
             raise StreamClosedException
-        length = None
-        while not length:
-            line = to_str(self._readline())
-            if line.startswith(CONTENT_LENGTH):
-                length = int(line[len(CONTENT_LENGTH) :])
-
-        line = to_str(self._readline()).strip()
-        while line:
-            line = to_str(self._readline()).strip()
-
-        content = to_str(self._reader.read(length))
-        return json.loads(content)
 
-    def _readline(self):
-        line = self._reader.readline()
-        if not line:
+        # ヘッダーは文字列にデコードせず、バイト列のまま解析します。
+        # 両端ともこのモジュールで書き込むため、通常は最初の行が Content-Length です。
+        # それ以外の行は、ストリームに紛れ込んだ出力として読み飛ばします。
+        line = self._readline()
+        while not line.startswith(_CONTENT_LENGTH_PREFIX):
+            line = self._readline()
+        length = int(line[_CONTENT_LENGTH_PREFIX_LEN:])
+
+        while self._readline() not in _HEADER_END:
+            pass
+
+        content = self._read(length)
+        if self._msgpack:
+            return msgpack.unpackb(content, raw=False, unicode_errors="surrogatepass")
+        return _loads(content)
+
+    def _fill(self, size: int = _READ_CHUNK_SIZE) -> None:
+        try:
+            chunk = self._raw.read(size)
+        except ValueError as exc:
+            # 別のスレッドでストリームが閉じられました。
+            raise StreamClosedException() from exc
+        if not chunk:
             raise EOFError
+        self._buffer += chunk
+
+    def _readline(self) -> bytes:
+        buffer = self._buffer
+        end = buffer.find(b"\n")
+        while end < 0:
+            searched = len(buffer)
+            self._fill()
+            end = buffer.find(b"\n", searched)
+        line = bytes(buffer[: end + 1])
+        del buffer[: end + 1]
         return line
 
+    def _read(self, length: int) -> bytearray:
+        buffer = self._buffer
+        while len(buffer) < length:
+            self._fill(max(length - len(buffer), _READ_CHUNK_SIZE))
+        content = buffer[:length]
+        del buffer[:length]
+        return content
+
 
 class JsonRpc:
     """JSON-RPC 経由のデータの送受信を管理します。"""
 
-    def __init__(self, reader: io.TextIOWrapper, writer: io.TextIOWrapper):
+    def __init__(
+        self,
+        reader: BinaryIO,
+        writer: BinaryIO,
+        batch_writes: bool = False,
+    ):
         self._reader = JsonReader(reader)
-        self._writer = JsonWriter(writer)
+        if batch_writes:
+            self._writer = BatchingJsonWriter(writer)
+        else:
+            self._writer = JsonWriter(writer)
+        # 他のスレッドが受信した、まだ取り出されていない応答。
+        self._responses: Dict[str, Any] = {}
+        self._response_ready = threading.Condition()
+        self._receiving = False
 
     def close(self):
         """基になるストリームを閉じます。"""
@@ -113,10 +347,69 @@ class JsonRpc:
         """JSON-RPC 形式でデータを受信します。"""
         return self._reader.read()
 
-
-def create_json_rpc(readable: BinaryIO, writable: BinaryIO) -> JsonRpc:
-    """読み取り可能および書き込み可能なストリーム用の JSON-RPC ラッパーを作成します。"""
-    return JsonRpc(readable, writable)
+    def set_format(self, message_format: str) -> None:
+        """以降のメッセージの形式 ("json" または "msgpack") を設定します。"""
+        self._reader.set_format(message_format)
+        self._writer.set_format(message_format)
+
+    def request(self, data):
+        """要求を送信し、同じ ID を持つ応答を返します。
+
+        複数のスレッドから同時に呼び出すことができます。ストリームから読み取るのは
+        一度に 1 つのスレッドだけで、他の要求への応答はその要求元に受け渡されます。
+        """
+        msg_id = data["id"]
+        self.send_data(data)
+        while True:
+            with self._response_ready:
+                if msg_id in self._responses:
+                    return self._responses.pop(msg_id)
+                if self._receiving:
+                    self._response_ready.wait()
+                    continue
+                self._receiving = True
+
+            try:
+                response = self.receive_data()
+            except BaseException:
+                with self._response_ready:
+                    self._receiving = False
+                    self._response_ready.notify_all()
+                raise
+
+            with self._response_ready:
+                self._receiving = False
+                self._responses[response.get("id")] = response
+                self._response_ready.notify_all()
+
+
+def create_json_rpc(
+    readable: BinaryIO, writable: BinaryIO, batch_writes: bool = False
+) -> JsonRpc:
+    """読み取り可能および書き込み可能なストリーム用の JSON-RPC ラッパーを作成します。
+
+    `batch_writes` が true の場合、短い間隔で送信されたメッセージは
+    まとめてストリームに書き込まれます。
+    """
+    return JsonRpc(readable, writable, batch_writes)
+
+
+def _resize_pipes(proc: subprocess.Popen) -> None:
+    """大きな出力を少ない読み書きで転送できるよう、パイプの容量を拡張します。"""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return
+    for stream in (proc.stdout, proc.stdin):
+        # 上限 (/proc/sys/fs/pipe-max-size) を超える場合などは既定の容量のまま使用します。
+        with contextlib.suppress(OSError):
+            fcntl.fcntl(stream.fileno(), _F_SETPIPE_SZ, _PIPE_BUFFER_SIZE)
+
+
+def _negotiate_format(rpc: JsonRpc) -> None:
+    """ランナーと合意したメッセージ形式に切り替えます。"""
+    response = rpc.request(
+        {"id": str(_next_id()), "method": "negotiate", "formats": SUPPORTED_FORMATS}
+    )
+    rpc.set_format(response.get("format", "json"))
 
 
 class ProcessManager:
@@ -127,14 +420,15 @@ class ProcessManager:
         self._processes: Dict[str, subprocess.Popen] = {}
         self._rpc: Dict[str, JsonRpc] = {}
         self._lock = threading.Lock()
-        self._thread_pool = ThreadPoolExecutor(10)
 
     def stop_all_processes(self):
-        """すべてのプロセスに終了コマンドを送信し、トランスポートをシャットダウンします。"""
-        for i in self._rpc.values():
-            with contextlib.suppress(Exception):
-                i.send_data({"id": str(uuid.uuid4()), "method": "exit"})
-        self._thread_pool.shutdown(wait=False)
+        """すべてのプロセスを終了し、トランスポートをシャットダウンします。"""
+        with self._lock:
+            processes = list(self._processes.values())
+            rpcs = list(self._rpc.values())
+            self._processes.clear()
+            self._rpc.clear()
+        _stop_processes(processes, rpcs)
 
     def start_process(self, workspace: str, args: Sequence[str], cwd: str) -> None:
         """プロセスを開始し、stdio 経由で JSON-RPC 通信を確立します。"""
@@ -145,32 +439,67 @@ class ProcessManager:
             stdout=subprocess.PIPE,
             stdin=subprocess.PIPE,
         )
-        self._processes[workspace] = proc
-        self._rpc[workspace] = create_json_rpc(proc.stdout, proc.stdin)
+        _resize_pipes(proc)
+        rpc = create_json_rpc(proc.stdout, proc.stdin)
+        if len(SUPPORTED_FORMATS) > 1:
+            # プロセスが終了している場合は、後続の要求で検出されます。
+            with contextlib.suppress(EOFError, OSError):
+                _negotiate_format(rpc)
+        with self._lock:
+            self._processes[workspace] = proc
+            self._rpc[workspace] = rpc
 
-        def _monitor_process():
-            proc.wait()
-            with self._lock:
-                try:
-                    del self._processes[workspace]
-                    rpc = self._rpc.pop(workspace)
-                    rpc.close()
-                except:  # pylint: disable=bare-except
-                    pass
+    def discard_process(self, workspace: str, rpc: JsonRpc) -> None:
+        """通信に失敗した JSON-RPC 接続のプロセスを終了し、管理対象から外します。
 
-        self._thread_pool.submit(_monitor_process)
+        プロセスの終了は、定期的な監視ではなく、要求の送受信で検出した
+        パイプの切断 (EOF や EPIPE) をきっかけに片付けます。
+        """
+        with self._lock:
+            # 同じワークスペースで新しいプロセスが既に開始されている場合は、
+            # 渡された接続だけを閉じます。
+            if self._rpc.get(workspace) is rpc:
+                del self._rpc[workspace]
+                processes = [self._processes.pop(workspace)]
+            else:
+                processes = []
+        _stop_processes(processes, [rpc])
 
     def get_json_rpc(self, workspace: str) -> JsonRpc:
         """指定された ID の JSON-RPC ラッパーを取得します。"""
-        with self._lock:
-            if workspace in self._rpc:
-                return self._rpc[workspace]
-        raise StreamClosedException()
+        # 辞書の単一の読み取りはアトミックなため、ロックは変更時にのみ使用します。
+        rpc = self._rpc.get(workspace)
+        if rpc is None:
+            raise StreamClosedException()
+        return rpc
+
+
+def _stop_processes(
+    processes: Sequence[subprocess.Popen], rpcs: Sequence[JsonRpc]
+) -> None:
+    # 終了コマンドを JSON-RPC で送信すると、終了しかけているプロセスへの
+    # 書き込みでブロックする可能性があるため、プロセスを直接終了します。
+    for proc in processes:
+        with contextlib.suppress(OSError):
+            proc.terminate()
+    for proc in processes:
+        try:
+            proc.wait(timeout=_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    for rpc in rpcs:
+        rpc.close()
 
 
 _process_manager = ProcessManager()
 atexit.register(_process_manager.stop_all_processes)
 
+# 同じワークスペースのプロセスが複数のスレッドから同時に開始されないようにするための、
+# ワークスペースごとのロック。
+_start_locks: Dict[str, threading.Lock] = {}
+_start_locks_lock = threading.Lock()
+
 
 def _get_json_rpc(workspace: str) -> Union[JsonRpc, None]:
     try:
@@ -186,13 +515,38 @@ def get_or_start_json_rpc(
 ) -> Union[JsonRpc, None]:
     """既存の JSON-RPC 接続を取得するか、接続を開始して返します。"""
     res = _get_json_rpc(workspace)
-    if not res:
-        args = [*interpreter, RUNNER_SCRIPT]
-        _process_manager.start_process(workspace, args, cwd)
+    if res:
+        return res
+
+    with _start_locks_lock:
+        start_lock = _start_locks.setdefault(workspace, threading.Lock())
+    with start_lock:
+        # ロックを待つ間に、他のスレッドがプロセスを開始している場合があります。
         res = _get_json_rpc(workspace)
+        if not res:
+            args = [*interpreter, RUNNER_SCRIPT]
+            _process_manager.start_process(workspace, args, cwd)
+            res = _get_json_rpc(workspace)
     return res
 
 
+def _get_running_json_rpc(
+    workspace: str, interpreter: Sequence[str], cwd: str
+) -> JsonRpc:
+    rpc = get_or_start_json_rpc(workspace, interpreter, cwd)
+    if not rpc:
+        raise Exception("Failed to run over JSON-RPC.")
+    return rpc
+
+
+def warmup_json_rpc(
+    workspace: str, interpreter: Sequence[str], cwd: str, module: str
+) -> None:
+    """ツールを実行する前にプロセスを開始し、ツールのモジュールを事前に読み込みます。"""
+    rpc = _get_running_json_rpc(workspace, interpreter, cwd)
+    rpc.request({"id": str(_next_id()), "method": "ping", "module": module, "cwd": cwd})
+
+
 class RpcRunResult:
     """RPC 経由でツールを実行した結果を保持するオブジェクト。"""
 
@@ -213,13 +567,8 @@ def run_over_json_rpc(
     source: str = None,
 ) -> RpcRunResult:
     """JSON-RPC を使用してコマンドを実行します。"""
-    rpc: Union[JsonRpc, None] = get_or_start_json_rpc(workspace, interpreter, cwd)
-    if not rpc:
-        raise Exception("Failed to run over JSON-RPC.")
-
-    msg_id = str(uuid.uuid4())
     msg = {
-        "id": msg_id,
+        "id": str(_next_id()),
         "method": "run",
         "module": module,
         "argv": argv,
@@ -229,14 +578,14 @@ def run_over_json_rpc(
     if source:
         msg["source"] = source
 
-    rpc.send_data(msg)
-
-    data = rpc.receive_data()
-
-    if data["id"] != msg_id:
-        return RpcRunResult(
-            "", f"Invalid result for request: {json.dumps(msg, indent=4)}"
-        )
+    rpc = _get_running_json_rpc(workspace, interpreter, cwd)
+    try:
+        data = rpc.request(msg)
+    except (StreamClosedException, EOFError, OSError):
+        # プロセスが終了している場合は、プロセスを片付けてから 1 回だけ再試行します。
+        _process_manager.discard_process(workspace, rpc)
+        rpc = _get_running_json_rpc(workspace, interpreter, cwd)
+        data = rpc.request(msg)
 
     result = data["result"] if "result" in data else ""
     if "error" in data:
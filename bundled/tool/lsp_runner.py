@@ -4,6 +4,8 @@
 Runner to use when running under a different interpreter.
 """
 
+import contextlib
+import importlib
 import os
 import pathlib
 import sys
@@ -35,6 +37,66 @@ import lsp_utils as utils
 
 RPC = jsonrpc.create_json_rpc(sys.stdin.buffer, sys.stdout.buffer)
 
+# ツール実行後に sys.path を復元するための、起動時の sys.path。
+PRISTINE_SYS_PATH = sys.path[:]
+
+
+# ツールは sys.argv や標準 IO などのプロセス全体の状態を置き換えて実行され、
+# `signal.signal` のようにメイン スレッドでしか使用できない API を呼ぶこともあるため、
+# 要求はすべてメイン スレッドで 1 つずつ処理します。
+def _handle_run(request):
+    is_exception = False
+    try:
+        # `utils.run_module` は `python -m <pytool-module>` の実行と同等です。
+        # ツールがプログラムAPIをサポートしている場合は、
+        # 以下の関数をツールのコードに置き換えてください。
+        # 作業ディレクトリの変更やIOストリームの管理などを処理する 
+        # `utils.run_api` ヘルパーも使用できます。
+        # また、`lsp_server.py` の `_run_tool_on_document` 関数と 
+        # `_run_tool` 関数も更新してください。
+        result = utils.run_module(
+            module=request["module"],
+            argv=request["argv"],
+            use_stdin=request["useStdin"],
+            cwd=request["cwd"],
+            source=request["source"] if "source" in request else None,
+        )
+    except Exception:  # pylint: disable=broad-except
+        result = utils.RunResult("", traceback.format_exc(chain=True))
+        is_exception = True
+
+    # これは sys.path を保持するために必要です。
+    # pylint は sys.path を変更するため、次回のシナリオでは機能しない可能性があります。
+    # 実行のたびにコピーを作る代わりに、変更された場合にだけ復元します。
+    if sys.path != PRISTINE_SYS_PATH:
+        sys.path[:] = PRISTINE_SYS_PATH
+
+    # 出力がない場合も、要求元が応答を待っているため ID だけの応答を返します。
+    if result.stderr:
+        return {"id": request["id"], "error": result.stderr, "exception": is_exception}
+    if result.stdout:
+        return {"id": request["id"], "result": result.stdout}
+    return {"id": request["id"]}
+
+
+def _handle_ping(request):
+    # 最初の `run` 要求を待たずに、ツールのモジュールを読み込んでおきます。
+    # 読み込み時の出力が JSON-RPC のストリームに混ざらないように、`utils.run_module` と
+    # 同様に作業ディレクトリ、argv、標準 IO を差し替えてから読み込み、出力は破棄します。
+    module = request["module"]
+    with contextlib.ExitStack() as stack:
+        if not utils.is_same_path(os.getcwd(), request["cwd"]):
+            stack.enter_context(utils.change_cwd(request["cwd"]))
+        stack.enter_context(utils.substitute_attr(sys, "argv", [module]))
+        stack.enter_context(utils.redirect_io("stdout", utils.CustomIO("<stdout>")))
+        stack.enter_context(utils.redirect_io("stderr", utils.CustomIO("<stderr>")))
+        with contextlib.suppress(Exception, SystemExit):
+            importlib.import_module(module)
+    if sys.path != PRISTINE_SYS_PATH:
+        sys.path[:] = PRISTINE_SYS_PATH
+    return {"id": request["id"]}
+
+
 EXIT_NOW = False
 while not EXIT_NOW:
     msg = RPC.receive_data()
@@ -44,35 +106,17 @@ while not EXIT_NOW:
         EXIT_NOW = True
         continue
 
+    if method == "negotiate":
+        # 両方で利用できる形式のうち、サーバーが優先するものを選択します。
+        # 応答は現在の形式で送信し、次のメッセージから新しい形式に切り替えます。
+        MESSAGE_FORMAT = next(
+            (f for f in msg["formats"] if f in jsonrpc.SUPPORTED_FORMATS), "json"
+        )
+        RPC.send_data({"id": msg["id"], "format": MESSAGE_FORMAT})
+        RPC.set_format(MESSAGE_FORMAT)
+        continue
+
     if method == "run":
-        is_exception = False
-        # これは sys.path を保持するために必要です。
-        # pylint は sys.path を変更するため、次回のシナリオでは機能しない可能性があります。
-        with utils.substitute_attr(sys, "path", sys.path[:]):
-            try:
-                # `utils.run_module` は `python -m <pytool-module>` の実行と同等です。
-                # ツールがプログラムAPIをサポートしている場合は、
-                # 以下の関数をツールのコードに置き換えてください。
-                # 作業ディレクトリの変更やIOストリームの管理などを処理する 
-                # `utils.run_api` ヘルパーも使用できます。
-                # また、`lsp_server.py` の `_run_tool_on_document` 関数と 
-                # `_run_tool` 関数も更新してください。
-                result = utils.run_module(
-                    module=msg["module"],
-                    argv=msg["argv"],
-                    use_stdin=msg["useStdin"],
-                    cwd=msg["cwd"],
-                    source=msg["source"] if "source" in msg else None,
-                )
-            except Exception:  # pylint: disable=broad-except
-                result = utils.RunResult("", traceback.format_exc(chain=True))
-                is_exception = True
-
-        response = {"id": msg["id"]}
-        if result.stderr:
-            response["error"] = result.stderr
-            response["exception"] = is_exception
-        elif result.stdout:
-            response["result"] = result.stdout
-
-        RPC.send_data(response)
+        RPC.send_data(_handle_run(msg))
+    elif method == "ping":
+        RPC.send_data(_handle_ping(msg))
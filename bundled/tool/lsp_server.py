@@ -1,16 +1,20 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 """Implementation of tool support over LSP."""
+
 from __future__ import annotations
 
-import copy
+import hashlib
+import itertools
 import json
 import os
 import pathlib
 import re
 import sys
 import sysconfig
+import threading
 import traceback
+from collections import OrderedDict
 from typing import Any, Optional, Sequence
 
 
@@ -36,7 +40,6 @@ update_sys_path(
 # 言語サーバーに必要なインポートはこれより下になります。
 # **********************************************************
 # pylint: disable=wrong-import-position,import-error
-import lsp_jsonrpc as jsonrpc
 import lsp_utils as utils
 import lsprotocol.types as lsp
 from pygls import server, uris, workspace
@@ -79,38 +82,111 @@ TOOL_ARGS = []  # default arguments always passed to your tool.
 # フル機能のリンター拡張機能については `pylint` 実装を参照してください。
 #  Pylint: https://github.com/microsoft/vscode-pylint/blob/main/bundled/tool
 
+# 短い間隔で届いた didOpen/didSave 通知をまとめるための待機時間 (秒)。
+# 待機中に同じドキュメントの通知が届いた場合、リンティングは 1 回だけ実行されます。
+LINT_DEBOUNCE_DELAY = 0.3
+
+_LINT_TIMERS: dict[str, threading.Timer] = {}
+# ドキュメントごとに、最後に予定したリンティングの世代番号。
+# 実行中に新しいリンティングが予定された場合、古い結果は公開しません。
+_LINT_GENERATIONS: dict[str, int] = {}
+# 保存時など、キャッシュされた結果を使わずにリンティングするドキュメント。
+_LINT_BYPASS_CACHE: set[str] = set()
+_LINT_TIMERS_LOCK = threading.Lock()
+_next_lint_generation = itertools.count(1).__next__
+
 
 @LSP_SERVER.feature(lsp.TEXT_DOCUMENT_DID_OPEN)
 def did_open(params: lsp.DidOpenTextDocumentParams) -> None:
     """textDocument/didOpen リクエストの LSP ハンドラー。"""
-    document = LSP_SERVER.workspace.get_document(params.text_document.uri)
-    diagnostics: list[lsp.Diagnostic] = _linting_helper(document)
-    LSP_SERVER.publish_diagnostics(document.uri, diagnostics)
+    _schedule_lint(params.text_document.uri)
 
 
 @LSP_SERVER.feature(lsp.TEXT_DOCUMENT_DID_SAVE)
 def did_save(params: lsp.DidSaveTextDocumentParams) -> None:
     """textDocument/didSave リクエストの LSP ハンドラー。"""
-    document = LSP_SERVER.workspace.get_document(params.text_document.uri)
-    diagnostics: list[lsp.Diagnostic] = _linting_helper(document)
-    LSP_SERVER.publish_diagnostics(document.uri, diagnostics)
+    # 保存時は、他のファイルや設定ファイルの変更も反映されるように、
+    # キャッシュされた結果を使わずにツールを実行します。
+    _schedule_lint(params.text_document.uri, use_cache=False)
 
 
 @LSP_SERVER.feature(lsp.TEXT_DOCUMENT_DID_CLOSE)
 def did_close(params: lsp.DidCloseTextDocumentParams) -> None:
     """textDocument/didClose リクエストの LSP ハンドラー。"""
     document = LSP_SERVER.workspace.get_document(params.text_document.uri)
+    _cancel_lint(document.uri)
+    _invalidate_result_cache(document.uri)
     # このファイルのエントリをクリアするために空の診断を公開します。
     LSP_SERVER.publish_diagnostics(document.uri, [])
 
 
-def _linting_helper(document: workspace.Document) -> list[lsp.Diagnostic]:
+def _schedule_lint(uri: str, use_cache: bool = True) -> None:
+    """待機中のリンティングを取り消し、待機時間の後に改めて実行します。"""
+    with _LINT_TIMERS_LOCK:
+        if not use_cache:
+            # まとめられた通知のいずれかがキャッシュを使わない場合、
+            # まとめた後のリンティングもキャッシュを使いません。
+            _LINT_BYPASS_CACHE.add(uri)
+        generation = _next_lint_generation()
+        timer = threading.Timer(
+            LINT_DEBOUNCE_DELAY, _submit_lint, args=(uri, generation)
+        )
+        timer.daemon = True
+        previous = _LINT_TIMERS.get(uri)
+        _LINT_TIMERS[uri] = timer
+        _LINT_GENERATIONS[uri] = generation
+    if previous:
+        previous.cancel()
+    timer.start()
+
+
+def _cancel_lint(uri: str) -> None:
+    with _LINT_TIMERS_LOCK:
+        timer = _LINT_TIMERS.pop(uri, None)
+        # 実行中のリンティングの結果も公開されないようにします。
+        _LINT_GENERATIONS.pop(uri, None)
+        _LINT_BYPASS_CACHE.discard(uri)
+    if timer:
+        timer.cancel()
+
+
+def _submit_lint(uri: str, generation: int) -> None:
+    with _LINT_TIMERS_LOCK:
+        if _LINT_TIMERS.get(uri) is not threading.current_thread():
+            # 取り消された後に起動したタイマーです。結果は公開されないため実行しません。
+            return
+        del _LINT_TIMERS[uri]
+        use_cache = uri not in _LINT_BYPASS_CACHE
+        _LINT_BYPASS_CACHE.discard(uri)
+
+    # リンティングはサーバーのスレッドプール (最大 MAX_WORKERS スレッド) で実行し、
+    # 他の LSP メッセージの処理を妨げないようにします。
+    LSP_SERVER.thread_pool_executor.submit(_lint_document, uri, generation, use_cache)
+
+
+def _lint_document(uri: str, generation: int, use_cache: bool) -> None:
+    document = LSP_SERVER.workspace.get_document(uri)
+    try:
+        diagnostics: list[lsp.Diagnostic] = _linting_helper(document, use_cache)
+    except Exception:  # pylint: disable=broad-except
+        log_error(traceback.format_exc(chain=True))
+        return
+    with _LINT_TIMERS_LOCK:
+        # リンティング中に新しいリンティングが予定された場合や、ドキュメントが
+        # 閉じられた場合は、古い結果で新しい診断を上書きしないように破棄します。
+        if _LINT_GENERATIONS.get(uri) == generation:
+            LSP_SERVER.publish_diagnostics(document.uri, diagnostics)
+
+
+def _linting_helper(
+    document: workspace.Document, use_cache: bool = True
+) -> list[lsp.Diagnostic]:
     # ツールが標準入力経由でのファイル内容の受け渡しをサポートしているかどうかを確認してください。
     # 変更時のリンティングをサポートする場合、ツールが効果的に機能するには、
     # 標準入力経由のリンティングをサポートしている必要があります。
     # プロジェクトの必要に応じて、_run_tool_on_document 関数と _run_tool 関数を読み、
     # 更新してください。
-    result = _run_tool_on_document(document)
+    result = _run_tool_on_document(document, use_cache=use_cache)
     return _parse_output_using_regex(result.stdout) if result.stdout else []
 
 
@@ -119,13 +195,17 @@ def _linting_helper(document: workspace.Document) -> list[lsp.Diagnostic]:
 # flake8の例:
 # flake8で以下のフォーマット引数を使用すると、以下の正規表現を使用して解析できます。
 # TOOL_ARGS += ["--format='%(row)d,%(col)d,%(code).1s,%(code)s:%(text)s'"]
-# DIAGNOSTIC_RE =
-#    r"(?P<line>\d+),(?P<column>-?\d+),(?P<type>\w+),(?P<code>\w+\d+):(?P<message>[^\r\n]*)"
+# 出力全体を 1 回で走査するため、正規表現は `(?m)` を付けて行頭と行末に固定してください。
+# 各行を囲む引用符は、行頭に引用符がある場合だけ行末の引用符を取り除くように、
+# 条件付きグループ `(?(q)')` で正規表現に含めます。
+# DIAGNOSTIC_RE = re.compile(
+#     r"(?m)^(?P<q>')?(?P<line>\d+),(?P<column>-?\d+),(?P<type>\w+),"
+#     r"(?P<code>\w+\d+):(?P<message>[^\r\n]*)(?(q)')\r?$"
+# )
 DIAGNOSTIC_RE = re.compile(r"")
 
 
 def _parse_output_using_regex(content: str) -> list[lsp.Diagnostic]:
-    lines: list[str] = content.splitlines()
     diagnostics: list[lsp.Diagnostic] = []
 
     line_at_1 = True
@@ -133,27 +213,23 @@ def _parse_output_using_regex(content: str) -> list[lsp.Diagnostic]:
 
     line_offset = 1 if line_at_1 else 0
     col_offset = 1 if column_at_1 else 0
-    for line in lines:
-        if line.startswith("'") and line.endswith("'"):
-            line = line[1:-1]
-        match = DIAGNOSTIC_RE.match(line)
-        if match:
-            data = match.groupdict()
-            position = lsp.Position(
-                line=max([int(data["line"]) - line_offset, 0]),
-                character=int(data["column"]) - col_offset,
-            )
-            diagnostic = lsp.Diagnostic(
-                range=lsp.Range(
-                    start=position,
-                    end=position,
-                ),
-                message=data.get("message"),
-                severity=_get_severity(data["code"], data["type"]),
-                code=data["code"],
-                source=TOOL_MODULE,
-            )
-            diagnostics.append(diagnostic)
+    for match in DIAGNOSTIC_RE.finditer(content):
+        data = match.groupdict()
+        position = lsp.Position(
+            line=max(int(data["line"]) - line_offset, 0),
+            character=int(data["column"]) - col_offset,
+        )
+        diagnostic = lsp.Diagnostic(
+            range=lsp.Range(
+                start=position,
+                end=position,
+            ),
+            message=data.get("message"),
+            severity=_get_severity(data["code"], data["type"]),
+            code=data["code"],
+            source=TOOL_MODULE,
+        )
+        diagnostics.append(diagnostic)
 
     return diagnostics
 
@@ -198,7 +274,11 @@ def _formatting_helper(document: workspace.Document) -> list[lsp.TextEdit] | Non
     # 標準入力経由のフォーマットをサポートしている必要があります。
     # フォーマッタの必要に応じて、読み取り、update_run_tool_on_document 
     # および _run_tool 関数を実行してください。
-    result = _run_tool_on_document(document, use_stdin=True)
+    # 書式設定はユーザーが明示的に要求する操作であり、フォーマッタはディスク上の
+    # 設定ファイル (pyproject.toml など) も読み込むため、キャッシュを使わずに実行します。
+    result = _run_tool_on_document(
+        document, use_stdin=True, purpose="format", use_cache=False
+    )
     if result.stdout:
         new_source = _match_line_endings(document, result.stdout)
         return [
@@ -213,20 +293,21 @@ def _formatting_helper(document: workspace.Document) -> list[lsp.TextEdit] | Non
     return None
 
 
-def _get_line_endings(lines: list[str]) -> str:
+def _get_line_endings(text: str) -> str:
     """テキストで使用されている行末文字列を返します。"""
-    try:
-        if lines[0][-2:] == "\r\n":
-            return "\r\n"
-        return "\n"
-    except Exception:  # pylint: disable=broad-except
+    if not text:
         return None
+    # 行のリストを作成せずに、最初の改行だけを調べます。
+    index = text.find("\n")
+    if index > 0 and text[index - 1] == "\r":
+        return "\r\n"
+    return "\n"
 
 
 def _match_line_endings(document: workspace.Document, text: str) -> str:
     """編集されたテキストの行末がドキュメントの行末と一致することを確認します。"""
-    expected = _get_line_endings(document.source.splitlines(keepends=True))
-    actual = _get_line_endings(text.splitlines(keepends=True))
+    expected = _get_line_endings(document.source)
+    actual = _get_line_endings(text)
     if actual == expected or actual is None or expected is None:
         return text
     return text.replace(actual, expected)
@@ -258,18 +339,54 @@ def initialize(params: lsp.InitializeParams) -> None:
     log_to_output(
         f"Global settings:\r\n{json.dumps(GLOBAL_SETTINGS, indent=4, ensure_ascii=False)}\r\n"
     )
+    _warmup_json_rpc()
 
 
 @LSP_SERVER.feature(lsp.EXIT)
 def on_exit(_params: Optional[Any] = None) -> None:
     """終了時にクリーンアップを処理します。"""
-    jsonrpc.shutdown_json_rpc()
+    _shutdown_json_rpc()
 
 
 @LSP_SERVER.feature(lsp.SHUTDOWN)
 def on_shutdown(_params: Optional[Any] = None) -> None:
     """シャットダウン時にクリーンアップを処理します。"""
-    jsonrpc.shutdown_json_rpc()
+    _shutdown_json_rpc()
+
+
+def _shutdown_json_rpc() -> None:
+    # `lsp_jsonrpc` は JSON-RPC を使用するときにだけインポートされます。
+    # インポートされていない場合は、停止するプロセスもありません。
+    jsonrpc = sys.modules.get("lsp_jsonrpc")
+    if jsonrpc is not None:
+        jsonrpc.shutdown_json_rpc()
+
+
+def _warmup_json_rpc() -> None:
+    """JSON-RPC を使用するワークスペースのプロセスを事前に開始します。"""
+    for settings in WORKSPACE_SETTINGS.values():
+        # `_run_tool_on_document` で JSON-RPC が使用される場合と同じ条件です。
+        if settings["path"] or not settings["interpreter"]:
+            continue
+        if utils.is_current_interpreter(settings["interpreter"][0]):
+            continue
+        # 初期化要求への応答を遅らせないよう、サーバーのスレッドプールで開始します。
+        LSP_SERVER.thread_pool_executor.submit(_warmup_workspace, settings)
+
+
+def _warmup_workspace(settings) -> None:
+    # pylint: disable-next=import-outside-toplevel
+    import lsp_jsonrpc as jsonrpc
+
+    try:
+        jsonrpc.warmup_json_rpc(
+            workspace=settings["workspaceFS"],
+            interpreter=settings["interpreter"],
+            cwd=settings["cwd"],
+            module=TOOL_MODULE,
+        )
+    except Exception:  # pylint: disable=broad-except
+        log_warning(traceback.format_exc(chain=True))
 
 
 def _get_global_defaults():
@@ -282,83 +399,182 @@ def _get_global_defaults():
     }
 
 
+def _add_tool_args(settings: dict) -> dict:
+    """ツールに常に渡す引数を、実行のたびに連結しないように事前に計算します。"""
+    settings["toolArgs"] = (*TOOL_ARGS, *settings["args"])
+    return settings
+
+
 def _update_workspace_settings(settings):
+    # 設定が変わるとツールの結果も変わる可能性があるため、キャッシュを破棄します。
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE.clear()
+
     if not settings:
         key = os.getcwd()
-        WORKSPACE_SETTINGS[key] = {
-            "cwd": key,
-            "workspaceFS": key,
-            "workspace": uris.from_fs_path(key),
-            **_get_global_defaults(),
-        }
-        return
+        WORKSPACE_SETTINGS[key] = _add_tool_args(
+            {
+                "cwd": key,
+                "workspaceFS": key,
+                "workspace": uris.from_fs_path(key),
+                **_get_global_defaults(),
+            }
+        )
+    else:
+        for setting in settings:
+            key = uris.to_fs_path(setting["workspace"])
+            WORKSPACE_SETTINGS[key] = _add_tool_args(
+                {
+                    "cwd": key,
+                    **setting,
+                    "workspaceFS": key,
+                }
+            )
 
-    for setting in settings:
-        key = uris.to_fs_path(setting["workspace"])
-        WORKSPACE_SETTINGS[key] = {
-            "cwd": key,
-            **setting,
-            "workspaceFS": key,
-        }
+    _update_workspace_roots()
 
 
-def _get_settings_by_path(file_path: pathlib.Path):
-    workspaces = {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}
+# ワークスペースのルートと、その配下のパスが持つ接頭辞の組。
+# 入れ子になったワークスペースでは最も深いものが選ばれるように、長い順に並べます。
+_WORKSPACE_ROOTS: list[tuple[str, str]] = []
 
-    while file_path != file_path.parent:
-        str_file_path = str(file_path)
-        if str_file_path in workspaces:
-            return WORKSPACE_SETTINGS[str_file_path]
-        file_path = file_path.parent
+
+def _update_workspace_roots() -> None:
+    roots = sorted(
+        {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}, key=len, reverse=True
+    )
+    _WORKSPACE_ROOTS[:] = [
+        (root, root if root.endswith(os.sep) else root + os.sep) for root in roots
+    ]
+
+
+def _find_workspace_root(file_path: str) -> str | None:
+    for root, prefix in _WORKSPACE_ROOTS:
+        if file_path == root or file_path.startswith(prefix):
+            return root
+    return None
+
+
+def _get_settings_by_path(file_path: pathlib.Path):
+    key = _find_workspace_root(os.fspath(file_path))
+    if key is not None:
+        return WORKSPACE_SETTINGS[key]
 
     setting_values = list(WORKSPACE_SETTINGS.values())
     return setting_values[0]
 
 
 def _get_document_key(document: workspace.Document):
-    if WORKSPACE_SETTINGS:
-        document_workspace = pathlib.Path(document.path)
-        workspaces = {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}
-
-        # 指定されたファイルのワークスペース設定を見つけます。
-        while document_workspace != document_workspace.parent:
-            if str(document_workspace) in workspaces:
-                return str(document_workspace)
-            document_workspace = document_workspace.parent
-
-    return None
+    # 指定されたファイルのワークスペース設定を見つけます。
+    return _find_workspace_root(document.path)
 
 
 def _get_settings_by_document(document: workspace.Document | None):
     if document is None or document.path is None:
-        return list(WORKSPACE_SETTINGS.values())[0]
+        return next(iter(WORKSPACE_SETTINGS.values()))
 
     key = _get_document_key(document)
     if key is None:
         # これはワークスペース以外のファイルであるか、ワークスペースがありません。
-        key = os.fspath(pathlib.Path(document.path).parent)
-        return {
-            "cwd": key,
-            "workspaceFS": key,
-            "workspace": uris.from_fs_path(key),
-            **_get_global_defaults(),
-        }
+        key = os.path.dirname(document.path)
+        return _add_tool_args(
+            {
+                "cwd": key,
+                "workspaceFS": key,
+                "workspace": uris.from_fs_path(key),
+                **_get_global_defaults(),
+            }
+        )
 
-    return WORKSPACE_SETTINGS[str(key)]
+    return WORKSPACE_SETTINGS[key]
 
 
 # *****************************************************
 # 内部実行 API
 # *****************************************************
+# 内容が変わっていないドキュメント (再オープンや書式設定の繰り返しなど) に対して
+# ツールを再実行しないように、実行結果をドキュメントの内容のハッシュで保持します。
+# ツールがディスク上のファイルを読み込む場合、結果はドキュメントの内容だけでは
+# 決まらないため、標準入力で内容を渡す場合 (use_stdin=True) だけキャッシュします。
+RESULT_CACHE_SIZE = 128
+_RESULT_CACHE: OrderedDict[tuple, utils.RunResult] = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+# 同じプロセス内でツールを実行する場合、sys.path や sys.argv、標準入出力などの
+# プロセス全体の状態を差し替えるため、スレッドプールから同時に実行しないようにします。
+# utils.run_module が取得する utils.CWD_LOCK とは別のロックです。
+RUN_LOCK = threading.Lock()
+
+
+def _get_result_cache_key(
+    document: workspace.Document, purpose: str, extra_args: Sequence[str]
+) -> tuple:
+    digest = hashlib.blake2b(
+        document.source.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+    return (document.uri, purpose, tuple(extra_args), digest)
+
+
+def _get_cached_result(cache_key: tuple) -> utils.RunResult | None:
+    with _RESULT_CACHE_LOCK:
+        result = _RESULT_CACHE.get(cache_key)
+        if result is not None:
+            _RESULT_CACHE.move_to_end(cache_key)
+        return result
+
+
+def _store_result(cache_key: tuple, result: utils.RunResult) -> None:
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[cache_key] = result
+        if len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+
+
+def _invalidate_result_cache(uri: str) -> None:
+    with _RESULT_CACHE_LOCK:
+        for key in [key for key in _RESULT_CACHE if key[0] == uri]:
+            del _RESULT_CACHE[key]
+
+
+def _run_module_in_process(
+    argv: Sequence[str], use_stdin: bool, cwd: str, source: str = None
+) -> utils.RunResult:
+    """ツールを言語サーバーと同じプロセス内のモジュールとして実行します。"""
+    # これは、ツールが sys.path を変更し、次回このシナリオでは機能しない可能性がある場合に、
+    # sys.path を保持するために必要です。
+    with RUN_LOCK, utils.substitute_attr(sys, "path", sys.path[:]):
+        try:
+            # `utils.run_module` は `python -m pyext` の実行と同等です。
+            # ツールがプログラムAPIをサポートしている場合は、以下の関数を
+            # ツールのコードに置き換えてください。
+            # 作業ディレクトリの変更やIOストリームの管理などを処理する 
+            # `utils.run_api` ヘルパーも使用できます。
+            # また、`lsp_runner.py` の `_run_tool` 関数と 
+            # `utils.run_module` も更新してください。
+            return utils.run_module(
+                module=TOOL_MODULE,
+                argv=argv,
+                use_stdin=use_stdin,
+                cwd=cwd,
+                source=source,
+            )
+        except Exception:
+            log_error(traceback.format_exc(chain=True))
+            raise
+
+
 def _run_tool_on_document(
     document: workspace.Document,
     use_stdin: bool = False,
     extra_args: Optional[Sequence[str]] = None,
+    purpose: str = "lint",
+    use_cache: bool = True,
 ) -> utils.RunResult | None:
     """Runs tool on the given document.
 
     if use_stdin is true then contents of the document is passed to the
-    tool via stdin.
+    tool via stdin. purpose ("lint" or "format") is part of the result
+    cache key, and use_cache=False skips the cache lookup.
     """
     if extra_args is None:
         extra_args = []
@@ -372,8 +588,16 @@ def _run_tool_on_document(
         # 標準ライブラリの Python ファイルをスキップします。
         return None
 
-    # 誤ってグローバル設定を更新しないように、ここでディープコピーを実行します。
-    settings = copy.deepcopy(_get_settings_by_document(document))
+    cache_key = (
+        _get_result_cache_key(document, purpose, extra_args) if use_stdin else None
+    )
+    result = _get_cached_result(cache_key) if cache_key and use_cache else None
+    if result is not None:
+        return result
+
+    # 設定はグローバルに共有されているため、変更しないでください。
+    # 引数リストは以下で常に新しいリストとして作成します。
+    settings = _get_settings_by_document(document)
 
     code_workspace = settings["workspaceFS"]
     cwd = settings["cwd"]
@@ -383,7 +607,7 @@ def _run_tool_on_document(
     if settings["path"]:
         # 「path」設定が何よりも優先されます。
         use_path = True
-        argv = settings["path"]
+        argv = list(settings["path"])
     elif settings["interpreter"] and not utils.is_current_interpreter(
         settings["interpreter"][0]
     ):
@@ -396,7 +620,8 @@ def _run_tool_on_document(
         # モジュールとして実行されます。
         argv = [TOOL_MODULE]
 
-    argv += TOOL_ARGS + settings["args"] + extra_args
+    argv += settings["toolArgs"]
+    argv += extra_args
 
     if use_stdin:
         # ドキュメントの内容をツールに標準入力経由で提供するために、
@@ -416,21 +641,31 @@ def _run_tool_on_document(
 
     if use_path:
         # このモードは実行可能ファイルを実行するときに使用されます。
-        log_to_output(" ".join(argv))
-        log_to_output(f"CWD Server: {cwd}")
+        # 任意の実行可能ファイルには実行ごとにプロセスを起動する以外の呼び出し方が
+        # ないため、ここではプロセスを再利用しません。ツールが常駐モード (stdin から
+        # 複数のリクエストを読み込むモードなど) をサポートしている場合は、
+        # `utils.run_path` を置き換えて、そのプロセスを使い回すようにしてください。
+        # `interpreter` 設定を使用する場合は、JSON-RPC のランナープロセスが
+        # 既に再利用されています。
+        _log_command(argv, "Server", cwd)
+        # 1 文字の検索は 2 文字の検索よりはるかに速いため、LF のみのファイルでは
+        # 置換のための走査を省略します。
+        source = document.source
+        source = source.replace("\r\n", "\n") if "\r" in source else source
         result = utils.run_path(
             argv=argv,
             use_stdin=use_stdin,
             cwd=cwd,
-            source=document.source.replace("\r\n", "\n"),
+            source=source,
         )
-        if result.stderr:
-            log_to_output(result.stderr)
     elif use_rpc:
         # このモードは、このサーバーを実行しているインタープリターが、
         # このサーバーの実行に使用されているインタープリターと異なる場合に使用されます。
-        log_to_output(" ".join(settings["interpreter"] + ["-m"] + argv))
-        log_to_output(f"CWD Linter: {cwd}")
+        # 起動時間を短縮するため、`lsp_jsonrpc` はこのモードでのみインポートします。
+        # pylint: disable-next=import-outside-toplevel
+        import lsp_jsonrpc as jsonrpc
+
+        _log_command([*settings["interpreter"], "-m", *argv], "Linter", cwd)
 
         result = jsonrpc.run_over_json_rpc(
             workspace=code_workspace,
@@ -443,45 +678,30 @@ def _run_tool_on_document(
         )
         if result.exception:
             log_error(result.exception)
+            # 一時的な失敗の可能性があるため、この結果はキャッシュしません。
+            cache_key = None
             result = utils.RunResult(result.stdout, result.stderr)
-        elif result.stderr:
-            log_to_output(result.stderr)
     else:
         # このモードでは、ツールは言語サーバーと同じプロセス内のモジュールとして実行されます。
-        log_to_output(" ".join([sys.executable, "-m"] + argv))
-        log_to_output(f"CWD Linter: {cwd}")
-        # これは、ツールが sys.path を変更し、次回このシナリオでは機能しない可能性がある場合に、
-        # sys.path を保持するために必要です。
-        with utils.substitute_attr(sys, "path", sys.path[:]):
-            try:
-                # `utils.run_module` は `python -m pyext` の実行と同等です。
-                # ツールがプログラムAPIをサポートしている場合は、以下の関数を
-                # ツールのコードに置き換えてください。
-                # 作業ディレクトリの変更やIOストリームの管理などを処理する 
-                # `utils.run_api` ヘルパーも使用できます。
-                # また、`lsp_runner.py` の `_run_tool` 関数と 
-                # `utils.run_module` も更新してください。
-                result = utils.run_module(
-                    module=TOOL_MODULE,
-                    argv=argv,
-                    use_stdin=use_stdin,
-                    cwd=cwd,
-                    source=document.source,
-                )
-            except Exception:
-                log_error(traceback.format_exc(chain=True))
-                raise
-        if result.stderr:
-            log_to_output(result.stderr)
-
-    log_to_output(f"{document.uri} :\r\n{result.stdout}")
+        _log_command([sys.executable, "-m", *argv], "Linter", cwd)
+        result = _run_module_in_process(argv, use_stdin, cwd, document.source)
+
+    if result.stderr:
+        log_to_output(result.stderr)
+    # ツールの出力全体を送信するのは、詳細なトレースが有効な場合だけです。
+    if is_log_enabled(verbose=True):
+        log_to_output(f"{document.uri} :\r\n{result.stdout}")
+    # ツールがエラーを出力した結果も、同じ理由でキャッシュしません。
+    if cache_key is not None and not result.stderr:
+        _store_result(cache_key, result)
     return result
 
 
 def _run_tool(extra_args: Sequence[str]) -> utils.RunResult:
     """Runs tool."""
-    # 誤ってグローバル設定を更新しないように、ここでディープコピーを実行します。
-    settings = copy.deepcopy(_get_settings_by_document(None))
+    # 設定はグローバルに共有されているため、変更しないでください。
+    # 引数リストは以下で常に新しいリストとして作成します。
+    settings = _get_settings_by_document(None)
 
     code_workspace = settings["workspaceFS"]
     cwd = settings["workspaceFS"]
@@ -491,7 +711,7 @@ def _run_tool(extra_args: Sequence[str]) -> utils.RunResult:
     if len(settings["path"]) > 0:
         # 「path」設定が何よりも優先されます。
         use_path = True
-        argv = settings["path"]
+        argv = list(settings["path"])
     elif len(settings["interpreter"]) > 0 and not utils.is_current_interpreter(
         settings["interpreter"][0]
     ):
@@ -508,16 +728,16 @@ def _run_tool(extra_args: Sequence[str]) -> utils.RunResult:
 
     if use_path:
         # このモードは実行可能ファイルを実行するときに使用されます。
-        log_to_output(" ".join(argv))
-        log_to_output(f"CWD Server: {cwd}")
+        _log_command(argv, "Server", cwd)
         result = utils.run_path(argv=argv, use_stdin=True, cwd=cwd)
-        if result.stderr:
-            log_to_output(result.stderr)
     elif use_rpc:
         # このモードは、このサーバーを実行しているインタープリターが、
         # このサーバーの実行に使用されているインタープリターと異なる場合に使用されます。
-        log_to_output(" ".join(settings["interpreter"] + ["-m"] + argv))
-        log_to_output(f"CWD Linter: {cwd}")
+        # 起動時間を短縮するため、`lsp_jsonrpc` はこのモードでのみインポートします。
+        # pylint: disable-next=import-outside-toplevel
+        import lsp_jsonrpc as jsonrpc
+
+        _log_command([*settings["interpreter"], "-m", *argv], "Linter", cwd)
         result = jsonrpc.run_over_json_rpc(
             workspace=code_workspace,
             interpreter=settings["interpreter"],
@@ -529,39 +749,37 @@ def _run_tool(extra_args: Sequence[str]) -> utils.RunResult:
         if result.exception:
             log_error(result.exception)
             result = utils.RunResult(result.stdout, result.stderr)
-        elif result.stderr:
-            log_to_output(result.stderr)
     else:
         # このモードでは、ツールは言語サーバーと同じプロセス内のモジュールとして実行されます。
-        log_to_output(" ".join([sys.executable, "-m"] + argv))
-        log_to_output(f"CWD Linter: {cwd}")
-        # これは、ツールが sys.path を変更し、次回このシナリオでは機能しない
-        # 可能性がある場合に、sys.path を保持するために必要です。
-        with utils.substitute_attr(sys, "path", sys.path[:]):
-            try:
-                # `utils.run_module` は `python -m pyext` の実行と同等です。
-                # ツールがプログラム API をサポートしている場合は、
-                # 以下の関数をツールのコードに置き換えてください。
-                # 作業ディレクトリの変更や IO ストリームの管理などを処理する 
-                # `utils.run_api` ヘルパーも使用できます。
-                # また、`lsp_runner.py` の `_run_tool_on_document` 関数と 
-                # `utils.run_module` も更新してください。
-                result = utils.run_module(
-                    module=TOOL_MODULE, argv=argv, use_stdin=True, cwd=cwd
-                )
-            except Exception:
-                log_error(traceback.format_exc(chain=True))
-                raise
-        if result.stderr:
-            log_to_output(result.stderr)
-
-    log_to_output(f"\r\n{result.stdout}\r\n")
+        _log_command([sys.executable, "-m", *argv], "Linter", cwd)
+        result = _run_module_in_process(argv, True, cwd)
+
+    if result.stderr:
+        log_to_output(result.stderr)
+    if is_log_enabled(verbose=True):
+        log_to_output(f"\r\n{result.stdout}\r\n")
     return result
 
 
 # *****************************************************
 # ログ記録と通知。
 # *****************************************************
+def is_log_enabled(verbose: bool = False) -> bool:
+    """クライアントが `$/setTrace` で設定したトレース レベルでログが有効な場合は True を返します。"""
+    # pygls は初期化前のトレース レベルを None としているため、その場合はログを有効とします。
+    trace = LSP_SERVER.lsp.trace
+    if verbose:
+        return trace in (None, lsp.TraceValues.Verbose)
+    return trace != lsp.TraceValues.Off
+
+
+def _log_command(argv: Sequence[str], label: str, cwd: str) -> None:
+    """トレースが有効な場合に、実行するコマンドと作業ディレクトリをログに記録します。"""
+    if is_log_enabled():
+        log_to_output(" ".join(argv))
+        log_to_output(f"CWD {label}: {cwd}")
+
+
 def log_to_output(
     message: str, msg_type: lsp.MessageType = lsp.MessageType.Log
 ) -> None:
@@ -4,6 +4,7 @@
 from __future__ import annotations
 
 import contextlib
+import functools
 import io
 import os
 import os.path
@@ -35,6 +36,7 @@ _site_paths = tuple(
 )
 
 
+@functools.lru_cache(maxsize=512)
 def is_same_path(file_path1, file_path2) -> bool:
     """2 つのパスが同じ場合は true を返します。"""
     return os.path.normcase(os.path.normpath(file_path1)) == os.path.normcase(
@@ -42,11 +44,13 @@ def is_same_path(file_path1, file_path2) -> bool:
     )
 
 
+@functools.lru_cache(maxsize=512)
 def is_current_interpreter(executable) -> bool:
     """実行可能パスが現在のインタープリターと同じ場合は true を返します。"""
     return is_same_path(executable, sys.executable)
 
 
+@functools.lru_cache(maxsize=512)
 def is_stdlib_file(file_path) -> bool:
     """ファイルが標準ライブラリに属している場合は True を返します。"""
     return os.path.normcase(os.path.normpath(file_path)).startswith(_site_paths)
@@ -61,6 +65,10 @@ class RunResult:
         self.stderr: str = stderr
 
 
+# io.StringIO の方が書き込みは速くなりますが、`sys.stdout.buffer` にバイト列を
+# 書き込んだり、`sys.stdin.buffer` から読み込んだり、`detach()` でストリームを
+# 取り出して包み直したりするツール (black や pylint など) が動作しなくなるため、
+# 意図的に BytesIO を包む TextIOWrapper として実装しています。
 class CustomIO(io.TextIOWrapper):
     """stdio を置き換えるカスタム ストリーム オブジェクト。"""
 
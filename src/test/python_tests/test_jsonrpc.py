@@ -0,0 +1,197 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for sending and receiving JSON-RPC messages over pipes.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+from hamcrest import assert_that, is_
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+import lsp_jsonrpc as jsonrpc
+
+TIMEOUT = 10  # 10 seconds
+
+FORMATS = jsonrpc.SUPPORTED_FORMATS
+
+
+@pytest.fixture(name="pipe")
+def _pipe():
+    """パイプの読み取り側と書き込み側のストリームを返します。"""
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, "rb")
+    writer = os.fdopen(write_fd, "wb")
+    yield reader, writer
+    for stream in (reader, writer):
+        if not stream.closed:
+            stream.close()
+
+
+def _write_in_thread(writer, messages):
+    """パイプのバッファを超えても詰まらないように、別スレッドで書き込みます。"""
+
+    def _write():
+        for message in messages:
+            writer.write(message)
+
+    thread = threading.Thread(target=_write, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("message_format", FORMATS)
+def test_large_message_round_trip(pipe, message_format):
+    """パイプのバッファより大きなメッセージを送受信できることをテストします。"""
+    reader = jsonrpc.JsonReader(pipe[0])
+    writer = jsonrpc.JsonWriter(pipe[1])
+    reader.set_format(message_format)
+    writer.set_format(message_format)
+    message = {"id": "1", "source": "x = 'あいう'\n" * 200_000}
+
+    thread = _write_in_thread(writer, [message, {"id": "2"}])
+
+    assert_that(reader.read(), is_(message))
+    assert_that(reader.read(), is_({"id": "2"}))
+    thread.join(TIMEOUT)
+
+
+@pytest.mark.parametrize("message_format", FORMATS)
+def test_stray_output_is_skipped(pipe, message_format):
+    """メッセージの前に紛れ込んだ出力が読み飛ばされることをテストします。"""
+    reader = jsonrpc.JsonReader(pipe[0])
+    writer = jsonrpc.JsonWriter(pipe[1])
+    reader.set_format(message_format)
+    writer.set_format(message_format)
+
+    os.write(pipe[1].fileno(), b"print from tool\nContent-Type: x\r\n\r\n")
+    writer.write({"id": "1", "result": "ok"})
+    os.write(pipe[1].fileno(), b"\n")
+    writer.write({"id": "2", "result": "ok"})
+
+    assert_that(reader.read(), is_({"id": "1", "result": "ok"}))
+    assert_that(reader.read(), is_({"id": "2", "result": "ok"}))
+
+
+@pytest.mark.parametrize("message_format", FORMATS)
+def test_surrogates_round_trip(pipe, message_format):
+    """対になっていないサロゲートを含む文字列を送受信できることをテストします。"""
+    reader = jsonrpc.JsonReader(pipe[0])
+    writer = jsonrpc.JsonWriter(pipe[1])
+    reader.set_format(message_format)
+    writer.set_format(message_format)
+    message = {"id": "1", "source": "x = '\ud800'\n"}
+
+    writer.write(message)
+
+    assert_that(reader.read(), is_(message))
+
+
+def test_eof_is_reported(pipe):
+    """書き込み側が閉じられた場合、EOFError が発生することをテストします。"""
+    reader = jsonrpc.JsonReader(pipe[0])
+    writer = jsonrpc.JsonWriter(pipe[1])
+
+    writer.write({"id": "1"})
+    writer.close()
+
+    assert_that(reader.read(), is_({"id": "1"}))
+    with pytest.raises(EOFError):
+        reader.read()
+
+
+def test_closed_streams_do_not_reach_reused_fds():
+    """閉じた後に番号が再利用されたファイル記述子を、古い接続が使用しないことをテストします。"""
+    read_fd, write_fd = os.pipe()
+    old_reader = jsonrpc.JsonReader(os.fdopen(read_fd, "rb"))
+    old_writer = jsonrpc.JsonWriter(os.fdopen(write_fd, "wb"))
+    old_reader.close()
+    old_writer.close()
+
+    # 閉じたばかりの番号は、次に作成するパイプに再利用されます。
+    new_read_fd, new_write_fd = os.pipe()
+    assert_that((new_read_fd, new_write_fd), is_((read_fd, write_fd)))
+    with (
+        os.fdopen(new_read_fd, "rb") as reader,
+        os.fdopen(new_write_fd, "wb") as writer,
+    ):
+        with pytest.raises(jsonrpc.StreamClosedException):
+            old_writer.write({"id": "old"})
+        jsonrpc.JsonWriter(writer).write({"id": "new"})
+        # 読み取りの途中でストリームが閉じられた場合も、新しいパイプから読み取りません。
+        with pytest.raises(jsonrpc.StreamClosedException):
+            old_reader._fill()  # pylint: disable=protected-access
+
+        assert_that(jsonrpc.JsonReader(reader).read(), is_({"id": "new"}))
+
+
+@pytest.mark.parametrize("message_format", FORMATS)
+def test_batching_writer_keeps_order(pipe, message_format):
+    """まとめて書き込まれたメッセージが、送信した順に読み取れることをテストします。"""
+    reader = jsonrpc.JsonReader(pipe[0])
+    writer = jsonrpc.BatchingJsonWriter(pipe[1], max_size=1024)
+    reader.set_format(message_format)
+    writer.set_format(message_format)
+    messages = [{"id": str(i), "result": "x" * (i % 7) * 100} for i in range(500)]
+
+    thread = _write_in_thread(writer, messages)
+    received = [reader.read() for _ in messages]
+    thread.join(TIMEOUT)
+    writer.close()
+
+    assert_that(received, is_(messages))
+    with pytest.raises(EOFError):
+        reader.read()
+
+
+@pytest.mark.parametrize("message_format", FORMATS)
+def test_concurrent_requests(message_format):
+    """複数のスレッドからの要求に、順不同の応答が正しく受け渡されることをテストします。"""
+    to_server = os.pipe()
+    to_client = os.pipe()
+    rpc = jsonrpc.JsonRpc(os.fdopen(to_client[0], "rb"), os.fdopen(to_server[1], "wb"))
+    rpc.set_format(message_format)
+    count = 20
+
+    def _respond():
+        server_reader = jsonrpc.JsonReader(os.fdopen(to_server[0], "rb"))
+        server_writer = jsonrpc.JsonWriter(os.fdopen(to_client[1], "wb"))
+        server_reader.set_format(message_format)
+        server_writer.set_format(message_format)
+        requests = [server_reader.read() for _ in range(count)]
+        # すべての要求を受け取ってから、逆の順序で応答します。
+        for request in reversed(requests):
+            server_writer.write({"id": request["id"], "result": request["value"] * 2})
+        server_reader.close()
+        server_writer.close()
+
+    server = threading.Thread(target=_respond, daemon=True)
+    server.start()
+
+    results = {}
+
+    def _request(index):
+        msg_id = str(index)
+        results[msg_id] = rpc.request({"id": msg_id, "value": index})
+
+    clients = [
+        threading.Thread(target=_request, args=(i,), daemon=True) for i in range(count)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join(TIMEOUT)
+    server.join(TIMEOUT)
+    rpc.close()
+
+    assert_that(
+        results,
+        is_({str(i): {"id": str(i), "result": i * 2} for i in range(count)}),
+    )
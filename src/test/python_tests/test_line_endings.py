@@ -0,0 +1,53 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for detecting the line endings of the formatted text.
+"""
+
+import os
+import sys
+
+import pytest
+from hamcrest import assert_that, is_
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+# pylint: disable=protected-access
+import lsp_server
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", None),
+        ("x = 1", "\n"),
+        ("x = 1\ny = 2\n", "\n"),
+        ("x = 1\r\ny = 2\r\n", "\r\n"),
+        ("\r\n", "\r\n"),
+        ("\n", "\n"),
+        # 最初の改行だけで判断します。
+        ("x = 1\ny = 2\r\n", "\n"),
+        ("x = 1\r\ny = 2\n", "\r\n"),
+    ],
+)
+def test_get_line_endings(text, expected):
+    """最初の改行から行末文字列を判断することをテストします。"""
+    assert_that(lsp_server._get_line_endings(text), is_(expected))
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "x = 1", "x = 1\ny = 2\n", "x = 1\r\ny = 2\r\n", "\r\n", "x = 1\ny = 2\r\n"],
+)
+def test_same_as_lines_based_helper(text):
+    """`document.lines` の最初の行から判断していた以前の実装と同じ結果になることをテストします。"""
+    lines = text.splitlines(keepends=True)
+    if not lines:
+        expected = None
+    else:
+        expected = "\r\n" if lines[0][-2:] == "\r\n" else "\n"
+
+    assert_that(lsp_server._get_line_endings(text), is_(expected))
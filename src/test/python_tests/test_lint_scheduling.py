@@ -0,0 +1,165 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for scheduling lint runs in the server.
+"""
+
+import os
+import sys
+import threading
+
+from hamcrest import assert_that, is_
+from lsprotocol import types as lsp
+from pygls.workspace import Workspace
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+# pylint: disable=protected-access
+import lsp_server
+
+TEST_URI = "file:///lint/sample.py"
+TIMEOUT = 5  # 5 seconds
+
+
+def _setup(monkeypatch, lint):
+    """ツールの実行と診断の公開を差し替え、公開された診断のリストとセマフォを返します。
+
+    セマフォはリンティングが 1 回終わるたびに解放されます。
+    """
+    monkeypatch.setattr(lsp_server, "LINT_DEBOUNCE_DELAY", 0.05)
+    monkeypatch.setattr(lsp_server, "_linting_helper", lint)
+    published = []
+    monkeypatch.setattr(
+        lsp_server.LSP_SERVER,
+        "publish_diagnostics",
+        lambda uri, diagnostics: published.append((uri, diagnostics)),
+    )
+
+    finished = threading.Semaphore(0)
+    lint_document = lsp_server._lint_document
+
+    def _lint_document(*args):
+        try:
+            lint_document(*args)
+        finally:
+            finished.release()
+
+    monkeypatch.setattr(lsp_server, "_lint_document", _lint_document)
+
+    # 初期化前のサーバーにはワークスペースがないため、空のワークスペースを使用します。
+    workspace = Workspace(None)
+    monkeypatch.setattr(type(lsp_server.LSP_SERVER), "workspace", workspace)
+    workspace.put_text_document(
+        lsp.TextDocumentItem(uri=TEST_URI, language_id="python", version=1, text="")
+    )
+    return published, finished
+
+
+def _wait(finished):
+    """リンティングが 1 回終わるまで待機し、終わった場合は True を返します。"""
+    return finished.acquire(timeout=TIMEOUT)  # pylint: disable=consider-using-with
+
+
+def test_notifications_are_debounced(monkeypatch):
+    """短い間隔で届いた通知のリンティングが 1 回にまとめられることをテストします。"""
+    calls = []
+
+    def _lint(_document, use_cache):
+        calls.append(use_cache)
+        return []
+
+    published, finished = _setup(monkeypatch, _lint)
+
+    for _ in range(5):
+        lsp_server._schedule_lint(TEST_URI)
+
+    # 置き換えられたタイマーはリンティングを実行しないため、1 回の終了を待てば十分です。
+    assert_that(_wait(finished), is_(True))
+    assert_that(calls, is_([True]))
+    assert_that(published, is_([(TEST_URI, [])]))
+    assert_that(TEST_URI in lsp_server._LINT_TIMERS, is_(False))
+
+
+def test_save_bypasses_cache_when_debounced(monkeypatch):
+    """まとめられた通知に保存が含まれる場合、キャッシュを使わないことをテストします。"""
+    calls = []
+
+    def _lint(_document, use_cache):
+        calls.append(use_cache)
+        return []
+
+    _, finished = _setup(monkeypatch, _lint)
+
+    lsp_server._schedule_lint(TEST_URI, use_cache=False)
+    lsp_server._schedule_lint(TEST_URI)
+
+    assert_that(_wait(finished), is_(True))
+    assert_that(calls, is_([False]))
+
+
+def test_stale_result_is_not_published(monkeypatch):
+    """実行中に新しいリンティングが予定された場合、古い結果が破棄されることをテストします。"""
+    first_started = threading.Event()
+    release_first = threading.Event()
+    runs = []
+
+    def _lint(_document, _use_cache):
+        runs.append(len(runs) + 1)
+        if len(runs) == 1:
+            first_started.set()
+            release_first.wait(TIMEOUT)
+            return ["stale"]
+        return ["latest"]
+
+    published, finished = _setup(monkeypatch, _lint)
+
+    lsp_server._schedule_lint(TEST_URI)
+    assert_that(first_started.wait(TIMEOUT), is_(True))
+    lsp_server._schedule_lint(TEST_URI)
+    # 2 回目のリンティングが、1 回目より先に終わります。
+    assert_that(_wait(finished), is_(True))
+    assert_that(published, is_([(TEST_URI, ["latest"])]))
+
+    release_first.set()
+    assert_that(_wait(finished), is_(True))
+    assert_that(published, is_([(TEST_URI, ["latest"])]))
+
+
+def test_close_drops_pending_lint(monkeypatch):
+    """ドキュメントを閉じると、待機中のリンティングが実行されないことをテストします。"""
+    calls = []
+    _setup(monkeypatch, lambda document, use_cache: calls.append(1) or [])
+    # 取り消す前にタイマーが起動しないように、待機時間を長くします。
+    monkeypatch.setattr(lsp_server, "LINT_DEBOUNCE_DELAY", TIMEOUT)
+
+    lsp_server._schedule_lint(TEST_URI)
+    timer = lsp_server._LINT_TIMERS[TEST_URI]
+    lsp_server._cancel_lint(TEST_URI)
+    timer.join(TIMEOUT)
+
+    assert_that(timer.is_alive(), is_(False))
+    assert_that(calls, is_([]))
+
+
+def test_close_drops_running_lint(monkeypatch):
+    """ドキュメントを閉じた後に、実行中のリンティングの結果が公開されないことをテストします。"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def _lint(_document, _use_cache):
+        started.set()
+        release.wait(TIMEOUT)
+        return ["closed"]
+
+    published, finished = _setup(monkeypatch, _lint)
+
+    lsp_server._schedule_lint(TEST_URI)
+    assert_that(started.wait(TIMEOUT), is_(True))
+    lsp_server._cancel_lint(TEST_URI)
+    release.set()
+
+    assert_that(_wait(finished), is_(True))
+    assert_that(published, is_([]))
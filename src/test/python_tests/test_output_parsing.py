@@ -0,0 +1,70 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for parsing the tool output with DIAGNOSTIC_RE.
+"""
+
+import os
+import re
+import sys
+
+from hamcrest import assert_that, is_
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+# pylint: disable=protected-access
+import lsp_server
+
+# lsp_server.py のコメントに記載している flake8 の例と同じ正規表現です。
+FLAKE8_RE = re.compile(
+    r"(?m)^(?P<q>')?(?P<line>\d+),(?P<column>-?\d+),(?P<type>\w+),"
+    r"(?P<code>\w+\d+):(?P<message>[^\r\n]*)(?(q)')\r?$"
+)
+
+
+def _parse(monkeypatch, content):
+    monkeypatch.setattr(lsp_server, "DIAGNOSTIC_RE", FLAKE8_RE)
+    return [
+        (d.range.start.line, d.range.start.character, d.code, d.message)
+        for d in lsp_server._parse_output_using_regex(content)
+    ]
+
+
+def test_unquoted_lines(monkeypatch):
+    """引用符で囲まれていない行の末尾の引用符が、メッセージに残ることをテストします。"""
+    content = "2,1,F,F821:undefined name 'bar'\r\n5,3,E,E501:line too long\n"
+
+    assert_that(
+        _parse(monkeypatch, content),
+        is_(
+            [
+                (1, 0, "F821", "undefined name 'bar'"),
+                (4, 2, "E501", "line too long"),
+            ]
+        ),
+    )
+
+
+def test_quoted_lines(monkeypatch):
+    """引用符で囲まれた行では、囲んでいる引用符だけが取り除かれることをテストします。"""
+    content = "'2,1,F,F821:undefined name 'bar''\n'5,3,E,E501:line too long'\r\n"
+
+    assert_that(
+        _parse(monkeypatch, content),
+        is_(
+            [
+                (1, 0, "F821", "undefined name 'bar'"),
+                (4, 2, "E501", "line too long"),
+            ]
+        ),
+    )
+
+
+def test_other_lines_are_ignored(monkeypatch):
+    """診断の形式に一致しない行が無視されることをテストします。"""
+    content = "checking 1 file\n'3,1,W,W291:trailing whitespace\n1,1,E,E999:ok\n"
+
+    assert_that(_parse(monkeypatch, content), is_([(0, 0, "E999", "ok")]))
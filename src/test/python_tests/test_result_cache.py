@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for caching tool results in the server.
+"""
+
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+from hamcrest import assert_that, is_
+from lsprotocol import types as lsp
+from pygls import uris
+from pygls.workspace import Workspace
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+# pylint: disable=protected-access
+import lsp_server
+
+
+@pytest.fixture(name="calls")
+def _calls(monkeypatch):
+    """ツールの実行を差し替え、実行の記録を返します。"""
+    calls = []
+
+    def _run_module(module, argv, use_stdin, cwd, source=None):
+        calls.append((module, argv, use_stdin, cwd, source))
+        stderr = "error" if "--fail" in argv else ""
+        return lsp_server.utils.RunResult(f"result {len(calls)}", stderr)
+
+    monkeypatch.setattr(lsp_server.utils, "run_module", _run_module)
+    return calls
+
+
+@pytest.fixture(name="document")
+def _document(monkeypatch, tmp_path, calls):  # pylint: disable=unused-argument
+    """同じプロセスでツールを実行する設定のドキュメントを返します。"""
+    monkeypatch.setattr(lsp_server, "_RESULT_CACHE", OrderedDict())
+    monkeypatch.setattr(lsp_server, "WORKSPACE_SETTINGS", {})
+    monkeypatch.setattr(lsp_server, "_WORKSPACE_ROOTS", [])
+    monkeypatch.setattr(lsp_server.LSP_SERVER, "publish_diagnostics", lambda *_: None)
+    # 初期化前のサーバーにはワークスペースがないため、空のワークスペースを使用します。
+    monkeypatch.setattr(type(lsp_server.LSP_SERVER), "workspace", Workspace(None))
+    lsp_server._update_workspace_settings([_get_settings(tmp_path)])
+
+    uri = uris.from_fs_path(os.fspath(tmp_path / "sample.py"))
+    lsp_server.LSP_SERVER.workspace.put_text_document(
+        lsp.TextDocumentItem(uri=uri, language_id="python", version=1, text="x = 1\n")
+    )
+    return lsp_server.LSP_SERVER.workspace.get_document(uri)
+
+
+def _get_settings(root):
+    return {
+        "workspace": uris.from_fs_path(os.fspath(root)),
+        "path": [],
+        "interpreter": [sys.executable],
+        "args": [],
+        "importStrategy": "useBundled",
+        "showNotifications": "off",
+    }
+
+
+def test_stdin_result_is_cached(document, calls):
+    """標準入力で内容を渡した場合、同じ内容に対してツールを再実行しないことをテストします。"""
+    first = lsp_server._run_tool_on_document(document, use_stdin=True)
+    second = lsp_server._run_tool_on_document(document, use_stdin=True)
+
+    assert_that(len(calls), is_(1))
+    assert_that(second.stdout, is_(first.stdout))
+
+
+def test_file_result_is_not_cached(document, calls):
+    """ツールがファイルを読み込む場合、結果をキャッシュしないことをテストします。"""
+    lsp_server._run_tool_on_document(document)
+    lsp_server._run_tool_on_document(document)
+
+    assert_that(len(calls), is_(2))
+
+
+def test_purpose_is_part_of_key(document, calls):
+    """リンティングと書式設定の結果が区別されることをテストします。"""
+    lint = lsp_server._run_tool_on_document(document, use_stdin=True)
+    fmt = lsp_server._run_tool_on_document(document, use_stdin=True, purpose="format")
+
+    assert_that(len(calls), is_(2))
+    assert_that(lint.stdout == fmt.stdout, is_(False))
+
+
+def test_use_cache_false_runs_tool(document, calls):
+    """use_cache=False の場合、キャッシュを使わずにツールを実行し、結果を更新することをテストします。"""
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+    refreshed = lsp_server._run_tool_on_document(
+        document, use_stdin=True, use_cache=False
+    )
+    cached = lsp_server._run_tool_on_document(document, use_stdin=True)
+
+    assert_that(len(calls), is_(2))
+    assert_that(cached.stdout, is_(refreshed.stdout))
+
+
+def test_result_with_stderr_is_not_cached(document, calls):
+    """ツールがエラーを出力した場合、結果をキャッシュしないことをテストします。"""
+    lsp_server._run_tool_on_document(document, use_stdin=True, extra_args=["--fail"])
+    lsp_server._run_tool_on_document(document, use_stdin=True, extra_args=["--fail"])
+
+    assert_that(len(calls), is_(2))
+
+
+def test_formatting_does_not_use_cache(document, calls):
+    """書式設定の要求では、毎回ツールを実行することをテストします。"""
+    first = lsp_server._formatting_helper(document)
+    second = lsp_server._formatting_helper(document)
+
+    assert_that(len(calls), is_(2))
+    assert_that(first[0].new_text, is_("result 1"))
+    assert_that(second[0].new_text, is_("result 2"))
+
+
+def test_changed_source_is_not_cached(document, calls):
+    """ドキュメントの内容が変わった場合、ツールを再実行することをテストします。"""
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+    lsp_server.LSP_SERVER.workspace.put_text_document(
+        lsp.TextDocumentItem(
+            uri=document.uri, language_id="python", version=2, text="x = 2\n"
+        )
+    )
+    changed = lsp_server.LSP_SERVER.workspace.get_document(document.uri)
+    lsp_server._run_tool_on_document(changed, use_stdin=True)
+
+    assert_that(len(calls), is_(2))
+
+
+def test_close_invalidates_cache(document, calls):
+    """ドキュメントを閉じると、そのドキュメントの結果が破棄されることをテストします。"""
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+    lsp_server.did_close(
+        lsp.DidCloseTextDocumentParams(
+            text_document=lsp.TextDocumentIdentifier(uri=document.uri)
+        )
+    )
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+
+    assert_that(len(calls), is_(2))
+
+
+def test_settings_update_invalidates_cache(document, calls, tmp_path):
+    """設定が更新されると、すべての結果が破棄されることをテストします。"""
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+    lsp_server._update_workspace_settings([_get_settings(tmp_path)])
+    lsp_server._run_tool_on_document(document, use_stdin=True)
+
+    assert_that(len(calls), is_(2))
@@ -0,0 +1,83 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Test for finding the workspace that a file belongs to.
+"""
+
+import os
+import sys
+
+import pytest
+from hamcrest import assert_that, is_
+from pygls import uris
+
+from .lsp_test_client import constants
+
+sys.path.insert(0, os.fspath(constants.PROJECT_ROOT / "bundled" / "tool"))
+
+# pylint: disable=wrong-import-position,wrong-import-order,import-error
+# pylint: disable=protected-access
+import lsp_server
+
+
+@pytest.fixture(name="root")
+def _root(monkeypatch, tmp_path):
+    """`ws` と、その配下の `ws/nested` をワークスペースとして設定し、親ディレクトリを返します。"""
+    monkeypatch.setattr(lsp_server, "WORKSPACE_SETTINGS", {})
+    monkeypatch.setattr(lsp_server, "_WORKSPACE_ROOTS", [])
+    lsp_server._update_workspace_settings(
+        [
+            {
+                "workspace": uris.from_fs_path(os.fspath(tmp_path / name)),
+                "path": [],
+                "interpreter": [sys.executable],
+                "args": [],
+                "importStrategy": "useBundled",
+                "showNotifications": "off",
+            }
+            for name in ("ws", os.path.join("ws", "nested"))
+        ]
+    )
+    return tmp_path
+
+
+def test_file_in_workspace(root):
+    """ワークスペース内のファイルが、そのワークスペースに属することをテストします。"""
+    path = os.fspath(root / "ws" / "x.py")
+
+    assert_that(lsp_server._find_workspace_root(path), is_(os.fspath(root / "ws")))
+
+
+def test_workspace_root_itself(root):
+    """ワークスペースのルート自体が、そのワークスペースに属することをテストします。"""
+    path = os.fspath(root / "ws")
+
+    assert_that(lsp_server._find_workspace_root(path), is_(path))
+
+
+def test_nested_workspace_wins(root):
+    """入れ子になったワークスペースでは、最も深いワークスペースが選ばれることをテストします。"""
+    path = os.fspath(root / "ws" / "nested" / "pkg" / "x.py")
+
+    assert_that(
+        lsp_server._find_workspace_root(path),
+        is_(os.fspath(root / "ws" / "nested")),
+    )
+
+
+def test_sibling_with_shared_prefix(root):
+    """名前の先頭が同じ兄弟ディレクトリのファイルが、ワークスペースに属さないことをテストします。"""
+    path = os.fspath(root / "ws2" / "x.py")
+
+    assert_that(lsp_server._find_workspace_root(path), is_(None))
+
+
+def test_file_outside_workspaces(root):
+    """どのワークスペースにも属さないファイルの設定が、そのディレクトリを使用することをテストします。"""
+    path = os.fspath(root / "other" / "x.py")
+
+    assert_that(lsp_server._find_workspace_root(path), is_(None))
+    settings = lsp_server._get_settings_by_document(
+        lsp_server.workspace.Document(uris.from_fs_path(path), source="")
+    )
+    assert_that(settings["cwd"], is_(os.fspath(root / "other")))